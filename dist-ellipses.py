@@ -29,10 +29,18 @@ Calculate the distance between two concentric ellipses, one of which has been ro
 import os
 import sys
 import math
+from collections import namedtuple
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import gridspec
 
+# numba is optional, it's only used to speed up the distance calculation
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
 # ----------
 # Default values
 
@@ -48,197 +56,201 @@ b2=5.0
 T=20  # inner ellipse rotation angle
 lT=T  # line of intersection angle
 
+# degrees to radians
+_D2R = math.pi / 180.0
+
 # ----------
 
 # check for obvious issues
-def check_for_issues():
-    if T == 90 and a2 == b1:
+def check_for_issues(a1, b1, a2, b2):
+    if 0 in (a1, b1, a2, b2):
         sys.stderr.write("WARNING: " + 
-            "The horizontal and vertical radii are equal and " +
+            "A radius of zero " +
             "will result in a divide by zero runtime error." + os.linesep)
 
 # ----------
 
-# Calculate y for a line passing through x at an angle t.
-# This is for a line passing through the origin (0, 0).
-# The angle t is in degrees.
-def get_position_y_at_angle(x, t):
-    trad = math.radians(t)
-    return math.tan(trad)*x
-
-def get_position_x_at_angle(y, t):
-    trad = math.radians(t)
-    return y / math.tan(trad)
-
-# ----------
-
-# rational representation: https://en.wikipedia.org/wiki/Ellipse
-# This method was used just for fun.
-# a: horizontal radius
-def get_ellipse_x_rational(u, a):
-    x = a * (1 - u**2) / (u**2 + 1)
-    return x
-
-# b: vertical radius
-def get_ellipse_y_rational(u, b):
-    y = (2*b*u) / (u**2 + 1)
-    return y
-
-# ----------
-
-# Standard parametric representation: https://en.wikipedia.org/wiki/Ellipse
-def get_ellipse_x_standard(t, a):
-    return a * (math.cos(math.radians(t)))
-
-def get_ellipse_y_standard(t, b):
-    return b * (math.sin(math.radians(t)))
-
-# ----------
-
-# rotate ellipse
-def get_ellipse_x_rotated(t, a, b, r):
-    trad = math.radians(t)
-    rrad = math.radians(r)
-    x = (a * math.cos(trad) * math.cos(rrad)) - (b * math.sin(trad) * math.sin(rrad))
-    return x
-
-def get_ellipse_y_rotated(t, a, b, r):
-    trad = math.radians(t)
-    rrad = math.radians(r)
-    y = (a * math.cos(trad) * math.sin(rrad)) + (b * math.sin(trad) * math.cos(rrad))
-    return y
+# The intersection of a ray from the origin and a rotated ellipse (at the origin).
+# Rather than intersecting the line y=tan(t)*x with the rotated ellipse, rotate
+# the ray into the ellipse's own frame and solve (x/a)^2 + (y/b)^2 = 1 for the
+# distance rho along the ray. This avoids tan() and the vertical line problem
+# at 90 and 270 degrees.
+# t_deg may be a scalar or a numpy array (degrees), r_deg is the ellipse rotation.
+# The intercept is at (rho*cos(t), rho*sin(t)).
+def ray_ellipse_dist(t_deg, a, b, r_deg):
+    phi = (t_deg - r_deg)*_D2R
+    c = np.cos(phi)
+    s = np.sin(phi)
+    return 1.0 / np.sqrt((c/a)**2 + (s/b)**2)
 
 # ----------
 
-# The intersection of a line and an ellipse
-def get_line_ellipse_x_intercept_standard(t, a, b):
-    # trad = math.radians(t)
-    # n=a**2 * b**2
-    # d=b**2 + (a**2 * math.tan(trad)**2)
-    # x = math.sqrt(n/d)
-    # # make sure we're in the right quadrant
-    # if lT > 90 and lT < 270:
-    #     x*=-1
-    # return x
-    return get_line_ellipse_x_intercept_rotated(t, a, b, 0)
+# The distance between the outer (a1, b1) ellipse and the inner (a2, b2) ellipse
+# rotated by T degrees, measured along the rays whose angles have cos c1 and
+# sin s1 (numpy arrays), so a sin/cos table can be shared with other calculations.
+# Both intercepts lie on the same ray so the distance is just the difference of
+# the two ray distances and the sign is preserved when the inner is outside the
+# outer ellipse.
+# The radii and rotation are constant for the whole sweep so their squares and
+# sin/cos are calculated once, and the ray is rotated into the inner ellipse's
+# frame with the angle difference identities instead of another sin/cos.
+def ellipse_diff_cos_sin(c1, s1, a1, b1, a2, b2, T):
+    ia1sq, ib1sq, ia2sq, ib2sq = 1/(a1*a1), 1/(b1*b1), 1/(a2*a2), 1/(b2*b2)
+    cr = math.cos(T*_D2R)
+    sr = math.sin(T*_D2R)
+
+    c2 = c1*cr + s1*sr
+    s2 = s1*cr - c1*sr
+    return 1.0 / np.sqrt(c1*c1*ia1sq + s1*s1*ib1sq) \
+        - 1.0 / np.sqrt(c2*c2*ia2sq + s2*s2*ib2sq)
+
+if HAVE_NUMBA:
+    # Same as above but fused into a single pass over the arrays so no
+    # temporary arrays are created.
+    @njit(parallel=True, fastmath=True)
+    def ellipse_diff_cos_sin(c1, s1, a1, b1, a2, b2, T):
+        ia1sq, ib1sq, ia2sq, ib2sq = 1/(a1*a1), 1/(b1*b1), 1/(a2*a2), 1/(b2*b2)
+        cr = math.cos(T*_D2R)
+        sr = math.sin(T*_D2R)
+
+        out = np.empty(c1.size)
+        for i in prange(c1.size):
+            c2 = c1[i]*cr + s1[i]*sr
+            s2 = s1[i]*cr - c1[i]*sr
+            inv_rho1 = math.sqrt(c1[i]*c1[i]*ia1sq + s1[i]*s1[i]*ib1sq)
+            inv_rho2 = math.sqrt(c2*c2*ia2sq + s2*s2*ib2sq)
+            out[i] = 1.0/inv_rho1 - 1.0/inv_rho2
+        return out
 
-# ----------
+# --------
 
-# The intersection of line and rotated ellipse (at the origin)
-# http://quickcalcbasic.com/ellipse%20line%20intersection.pdf
-def get_line_ellipse_x_intercept_rotated(t, a, b, r):
-    trad = math.radians(t)
-    rrad = math.radians(r)
-    m = math.tan(trad)
+# The results of compute(), everything needed to draw the plot.
+# t, diff: the angles (degrees) and distance between the ellipses along them
+# ellipses: one contiguous (4, N) array of outer x, outer y, inner x, inner y
+# unrotated: (2, N) x, y of the inner ellipse before it's rotated
+# line: (2, N) x, y of the line at the set angle
+# points: (2, 2) x, y of the intersection with the outer and inner ellipses
+# limits: the x and y limits for the ellipse plot
+EllipseResult = namedtuple("EllipseResult",
+    ["t", "diff", "ellipses", "unrotated", "line", "points", "limits"])
+
+# Calculate everything that is plotted, without touching matplotlib, so this
+# can be called in a loop (e.g. for a parameter study).
+def compute(a1, b1, a2, b2, T, lT):
+
+    # a line at set angle
+    # (a line through the origin, the angle is constant so only one tan is needed)
+    x1 = np.arange(-1*a1, a1+1, 1.0)
+    line = np.vstack((x1, math.tan(lT*_D2R)*x1))
+    
+    # Standard parametric representation: https://en.wikipedia.org/wiki/Ellipse
+    # Everything is calculated from the same angles (every 0.1 degree) so the
+    # sin and cos are calculated once and shared as a lookup table. The
+    # distance uses every angle so the table stays in double precision.
+    t = np.linspace(0, 360, 3600, endpoint=False)
+    trad = t*_D2R
+    ct = np.cos(trad)
+    st = np.sin(trad)
+
+    # The ellipses are only for display and at the usual figure size a point
+    # every 0.5 degree can't be told apart from more, so only every 5th angle
+    # is used, and they're calculated in single precision. The first point is
+    # repeated to close them.
+    tp = np.r_[0:t.size:5, 0]
+    ctp = ct[tp].astype(np.float32)
+    stp = st[tp].astype(np.float32)
+
+    # the second (inner) ellipse before it's rotated (just for fun)
+    # (this is only an outline so a point every degree is enough)
+    tg = np.r_[0:t.size:10, 0]
+    unrotated = np.vstack((a2*ct[tg], b2*st[tg]))
+
+    cr = math.cos(T*_D2R)
+    sr = math.sin(T*_D2R)
+
+    ellipses = np.empty((4, tp.size), dtype=np.float32)
+    # the first ellipse (not rotated)
+    ellipses[0] = a1*ctp
+    ellipses[1] = b1*stp
+    # the second ellipse, rotated
+    ellipses[2] = a2*ctp*cr - b2*stp*sr
+    ellipses[3] = a2*ctp*sr + b2*stp*cr
+
+    # 2 points along the line of intersection
+    # the first is the intersection with the first ellipse (not rotated) and
+    # the second is the intersection with the second ellipse (rotated)
+    rho = np.array([ray_ellipse_dist(lT, a1, b1, 0), ray_ellipse_dist(lT, a2, b2, T)])
+    points = np.column_stack((rho*math.cos(lT*_D2R), rho*math.sin(lT*_D2R)))
+    
+    # calculate the difference between the two ellipses
+    # (always pass floats so numba only compiles the kernel once)
+    diff = ellipse_diff_cos_sin(ct, st, float(a1), float(b1), float(a2), float(b2), float(T))
 
-    if t == 90 or r == 270:
-        x = get_line_ellipse_y_intercept_rotated(t, a, b, r, 0)
-    else:
-        A = b**2 * (math.cos(rrad)**2 + 2 * m * math.cos(rrad) * math.sin(rrad) + m**2 * math.sin(rrad)**2) \
-            + a**2 * (m**2 * math.cos(rrad)**2 - 2 * m * math.cos(rrad) * math.sin(rrad) + math.sin(rrad)**2)
-        B = 0 # all drops out b/c b1=0 in y=mx+b1
-        C = -1 * a**2 * b**2
-        # quadratic eq.
-        x = (-1 * B + math.sqrt(B**2 - 4 * A * C)) / (2 * A)
-
-    # make sure we're in the correct quadrant
-    if lT > 90 and lT <= 270:
-        x*=-1
-    return x
-
-# ---------
-
-def get_line_ellipse_y_intercept_rotated(t, a, b, r, x):
-     rrad = math.radians(r)
-
-     A = b**2 * math.sin(rrad)**2 + a**2 * math.cos(rrad)**2
-     B = 2 * x * math.cos(rrad) * math.sin(b**2 - a**2)
-     C = x**2 * (b**2 * math.cos(rrad)**2 + a**2 * math.sin(rrad)**2) - a**2 * b**2
-     # quadratic eq.
-     y = (-1 * B + math.sqrt(B**2 - 4 * A * C)) / (2 * A)
-     return get_position_x_at_angle(y, t)
+    return EllipseResult(t, diff, ellipses, unrotated, line, points, (a1+1, b1+1))
 
 # --------
 
-def main():
-    
-    check_for_issues()
-    
+# Plot the results of compute(). If fig is given it's cleared and reused
+# rather than creating a new figure.
+def plot(result, fig=None):
+
     # setup the plot
-    plt.figure(figsize=(8, 5))
-    gs = gridspec.GridSpec(1, 2, width_ratios=[3, 1]) 
-    ax0 = plt.subplot(gs[0])
-    ax1 = plt.subplot(gs[1])
+    if fig is None:
+        fig = plt.figure(figsize=(8, 5))
+    else:
+        fig.clear()
+    gs = gridspec.GridSpec(1, 2, width_ratios=[3, 1], figure=fig)
+    ax0 = fig.add_subplot(gs[0])
+    ax1 = fig.add_subplot(gs[1])
     
     ax0.set_title("Concentric Ellipses")
     ax1.set_title("Distance between Ellipses")
     ax1.set_xlabel("Degrees")
 
-    ax0.set_xlim(-1*(a1+1), a1+1)
-    ax0.set_ylim(-1*(b1+1), b1+1)
+    xlim, ylim = result.limits
+    ax0.set_xlim(-1*xlim, xlim)
+    ax0.set_ylim(-1*ylim, ylim)
 
     # plot a line at set angle
-    vect_get_position_y_at_angle = np.vectorize(get_position_y_at_angle, excluded='x')
-    x1 = np.arange(-1*a1, a1+1, 1.0)
-    ax0.plot(x1, vect_get_position_y_at_angle(x1, lT), color='red')
+    ax0.plot(result.line[0], result.line[1], color='red')
     
     # Display the second (inner) ellipse before it's rotated (just for fun)
-    u = np.arange(-1000, 1000, 0.1)
-    ax0.plot(get_ellipse_x_rational(u, a2), get_ellipse_y_rational(u, b2), color='lightgray')
-    
+    ax0.plot(result.unrotated[0], result.unrotated[1], color='lightgray')
+
     # plot the first ellipse (not rotated)
-    vect_get_ellipse_x_standard = np.vectorize(get_ellipse_x_standard, excluded='a')
-    vect_get_ellipse_y_standard = np.vectorize(get_ellipse_y_standard, excluded='b')
-    t = np.arange(0, 360, 0.01)
-    ax0.plot(vect_get_ellipse_x_standard(t, a1), vect_get_ellipse_y_standard(t, b1), color='orange')
+    ax0.plot(result.ellipses[0], result.ellipses[1], color='orange')
     
     # plot the second ellipse, rotated
-    vect_get_ellipse_x_rotated = np.vectorize(get_ellipse_x_rotated, excluded=['a', 'b', 'r'])
-    vect_get_ellipse_y_rotated = np.vectorize(get_ellipse_y_rotated, excluded=['a', 'b', 'r'])
-    t = np.arange(0, 360, 0.01)
-    ax0.plot(vect_get_ellipse_x_rotated(t, a2, b2, T), vect_get_ellipse_y_rotated(t, a2, b2, T), color='blue')
+    ax0.plot(result.ellipses[2], result.ellipses[3], color='blue')
 
     # plot 2 points along the line of intersection
-    
-    # plot the point of intersection with the first ellipse (not rotated)
-    vect_get_line_ellipse_x_intercept_standard = np.vectorize(get_line_ellipse_x_intercept_standard, excluded=['a', 'b'])
-    x=get_line_ellipse_x_intercept_standard(lT, a1, b1)
-    y=get_position_y_at_angle(x, lT)
-    print ("green: %f,%f" % (x,y))
     # should be a green dot on the orange ellipse intersecting the red line
-    ax0.plot(x, y, 'ro', color='green')
-    
-    # plot the point of intersection with the second ellipse (rotated)
-    vect_get_line_ellipse_x_intercept_rotated = np.vectorize(get_line_ellipse_x_intercept_rotated, excluded=['a', 'b', 'r'])
-    x=get_line_ellipse_x_intercept_rotated(lT, a2, b2, T)
-    y=get_position_y_at_angle(x, lT)
-    print ("black: %f,%f" % (x,y))
+    ax0.plot(result.points[0, 0], result.points[0, 1], 'ro', color='green')
     # should be a black dot on the blue ellipse intersecting the red line
-    ax0.plot(x, y, 'ro', color='black')
+    ax0.plot(result.points[1, 0], result.points[1, 1], 'ro', color='black')
     
     # ----------
     
-    # calculate the difference between the two ellipses
-    t = np.arange(0, 360, 0.1)
-    
-    xnorm=vect_get_line_ellipse_x_intercept_standard(t, a1, b1)
-    ynorm=vect_get_position_y_at_angle(xnorm, t)
-    
-    xrot=vect_get_line_ellipse_x_intercept_rotated(t, a2, b2, T)
-    yrot=vect_get_position_y_at_angle(xrot, t)
-    
-    # find the diff and when the inner is outside the outer ellipse preserve the sign
-    # (divide by zero is possible and should be caught)
-    vect_hypot = np.vectorize(math.hypot)
-    diff = vect_hypot(xnorm-xrot, ynorm-yrot) * ((xnorm-xrot) / abs(xnorm-xrot))
-    
-    ax1.plot(t, diff, color='pink')
+    ax1.plot(result.t, result.diff, color='pink')
     
     # ----------
     
     ax0.set_aspect('equal', 'box')
     
-    plt.tight_layout()
+    fig.tight_layout()
+    return fig
+
+# --------
+
+def main():
+    
+    check_for_issues(a1, b1, a2, b2)
+
+    result = compute(a1, b1, a2, b2, T, lT)
+    print ("green: %f,%f" % tuple(result.points[0]))
+    print ("black: %f,%f" % tuple(result.points[1]))
+
+    plot(result)
     plt.show()
 
 